@@ -31,6 +31,7 @@ a = Analysis(
         'backend.db_operations',
         'backend.db_supabase',
         'backend.payment_stripe',
+        'h2',  # httpx http2=True imports it lazily
         'uvicorn.lifespan.on',
         'uvicorn.lifespan.off',
         'uvicorn.protocols.http.auto',
@@ -26,6 +26,8 @@ CREATE TABLE IF NOT EXISTS user_plans (
 CREATE INDEX IF NOT EXISTS idx_user_plans_user_id ON user_plans(user_id);
 CREATE INDEX IF NOT EXISTS idx_user_plans_stripe_customer_id ON user_plans(stripe_customer_id);
 CREATE INDEX IF NOT EXISTS idx_user_plans_stripe_subscription_id ON user_plans(stripe_subscription_id);
+-- Partial index for fix_plan_inconsistency.py (active subscriptions still on the start plan)
+CREATE INDEX IF NOT EXISTS idx_user_plans_active_start_plan ON user_plans(user_id) WHERE subscription_status = 'active' AND plan = 'start';
 
 -- 2. API Call Log Table
 CREATE TABLE IF NOT EXISTS usage_logs (
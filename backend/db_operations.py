@@ -357,42 +357,50 @@ async def update_user_plan(
         - All plan-related parameters use PlanType enum and are converted to strings internally
         - None means "don't update this field", _CLEAR_FIELD means "set this field to NULL"
         - Only non-None values are updated (partial updates supported)
+        - If every field being set already matches the stored row, the upsert is skipped
+          and the stored row is returned (updated_at is not bumped)
     """
     try:
         supabase = get_supabase()
         
+        # Read the existing row once: it drives the quota checks below, the 'starter' fix and the no-op check before upsert
+        existing_row = None
+        existing_plan_value = None
+        try:
+            existing_response = supabase.table("user_plans").select("*").eq("user_id", user_id).maybe_single().execute()
+            if existing_response.data:
+                existing_row = existing_response.data
+                existing_plan_value = existing_row.get("plan")
+        except Exception as e:
+            # If this is a new user, the read will fail (no record exists), which is OK
+            print(f"⚠️ Failed to read existing plan (may be new user): {e}")
+        
         # If plan is to be updated, check if quota needs to be reset (upgrading from start to other plan)
         # or adjusted (downgrading to start plan)
         should_reset_quota = False
         should_adjust_quota_for_start = False
         old_plan = None
-        if plan is not None:
-            # Get old plan
+        if plan is not None and existing_plan_value:
             try:
-                old_plan_response = supabase.table("user_plans").select("plan").eq("user_id", user_id).maybe_single().execute()
-                if old_plan_response.data:
-                    old_plan_value = old_plan_response.data.get("plan")
-                    if old_plan_value:
-                        # Normalize 'starter' to 'start' before converting to PlanType
-                        if old_plan_value == 'starter':
-                            old_plan_value = 'start'
-                        old_plan = PlanType(old_plan_value)
-                        # If upgrading from start plan to normal/high plan, need to reset quota
-                        if old_plan == PlanType.START and plan != PlanType.START:
-                            should_reset_quota = True
-                            print(f"🔄 User {user_id} upgrading from start plan to {plan.value} plan, will reset quota")
-                        # If downgrading to start plan, need to adjust quota (cap at lifetime limit)
-                        elif old_plan != PlanType.START and plan == PlanType.START:
-                            should_adjust_quota_for_start = True
-                            print(f"🔄 User {user_id} downgrading to start plan, will adjust quota to lifetime limit")
+                # Normalize 'starter' to 'start' before converting to PlanType
+                old_plan = PlanType('start' if existing_plan_value == 'starter' else existing_plan_value)
+                # If upgrading from start plan to normal/high plan, need to reset quota
+                if old_plan == PlanType.START and plan != PlanType.START:
+                    should_reset_quota = True
+                    print(f"🔄 User {user_id} upgrading from start plan to {plan.value} plan, will reset quota")
+                # If downgrading to start plan, need to adjust quota (cap at lifetime limit)
+                elif old_plan != PlanType.START and plan == PlanType.START:
+                    should_adjust_quota_for_start = True
+                    print(f"🔄 User {user_id} downgrading to start plan, will adjust quota to lifetime limit")
             except Exception as e:
-                print(f"⚠️ Failed to check old plan (may be new user): {e}")
+                print(f"⚠️ Failed to check old plan: {e}")
         
         # Build data dictionary
-        now = utcnow()
+        # Format the timestamp once; the quota updates below reuse it
+        now_iso = utcnow().isoformat()
         data = {
             "user_id": user_id,
-            "updated_at": now.isoformat()
+            "updated_at": now_iso
         }
         
         # Helper function to convert PlanType to normalized string value
@@ -469,27 +477,22 @@ async def update_user_plan(
         # Before upsert, ALWAYS check if existing record has 'starter' value and fix it
         # This is critical because if plan is None (partial update), data won't include plan field
         # and the 'starter' value would remain in database, causing constraint violations
-        existing_plan_value = None
-        try:
-            existing_response = supabase.table("user_plans").select("plan").eq("user_id", user_id).maybe_single().execute()
-            if existing_response.data:
-                existing_plan_value = existing_response.data.get("plan")
-                if existing_plan_value == 'starter':
-                    # Fix existing 'starter' value to 'start' before upsert
-                    # This must be done BEFORE upsert to avoid constraint violations
-                    # Add condition to only update if plan is still 'starter' (prevent race condition)
-                    fix_response = supabase.table("user_plans").update({"plan": "start"}).eq("user_id", user_id).eq("plan", "starter").execute()
-                    if fix_response.data:
-                        print(f"✅ Fixed existing 'starter' plan value for user {user_id}")
-                        existing_plan_value = 'start'  # Update local variable
-                    else:
-                        print(f"⚠️ Fix update returned no data for user {user_id}")
-        except Exception as fix_error:
-            # If fix fails, log error but continue with upsert
-            # If this is a new user, the fix will fail (no record exists), which is OK
-            print(f"⚠️ Could not fix existing plan (may be new user): {fix_error}")
-            import traceback
-            traceback.print_exc()
+        if existing_plan_value == 'starter':
+            try:
+                # Fix existing 'starter' value to 'start' before upsert
+                # This must be done BEFORE upsert to avoid constraint violations
+                # Add condition to only update if plan is still 'starter' (prevent race condition)
+                fix_response = supabase.table("user_plans").update({"plan": "start"}).eq("user_id", user_id).eq("plan", "starter").execute()
+                if fix_response.data:
+                    print(f"✅ Fixed existing 'starter' plan value for user {user_id}")
+                    existing_plan_value = 'start'  # Update local variable
+                else:
+                    print(f"⚠️ Fix update returned no data for user {user_id}")
+            except Exception as fix_error:
+                # If fix fails, log error but continue with upsert
+                print(f"⚠️ Could not fix existing plan: {fix_error}")
+                import traceback
+                traceback.print_exc()
         
         # CRITICAL FIX: If plan is None (partial update), we must include 'plan' in data
         # to prevent database from using default value 'starter' (which violates constraint)
@@ -504,6 +507,13 @@ async def update_user_plan(
                 data["plan"] = "start"
             # If existing_plan_value exists, don't add plan to data (partial update)
         
+        # Skip the write when every field being set already has that value (e.g. webhook replays)
+        # Calls that set no fields at all still upsert, so they keep bumping updated_at
+        changes = {key: value for key, value in data.items() if key not in ("user_id", "updated_at")}
+        if existing_row and changes and all(key in existing_row and existing_row[key] == value for key, value in changes.items()):
+            print(f"⏭️ user_plans for user {user_id} already up to date, skipping upsert")
+            return UserPlan(**normalize_plan_data(existing_row))
+        
         # Use upsert, with user_id as unique key
         # Insert if record doesn't exist, update if exists
         try:
@@ -564,12 +574,11 @@ async def update_user_plan(
         # If need to reset quota (upgrading from start to other plan)
         if should_reset_quota and plan is not None:
             try:
-                now = utcnow()
                 quota_update_data = {
                     "weekly_tokens_used": 0,
-                    "quota_reset_date": now.isoformat(),
+                    "quota_reset_date": now_iso,
                     "plan": plan.value,  # Also update plan in quota
-                    "updated_at": now.isoformat()
+                    "updated_at": now_iso
                 }
                 quota_response = supabase.table("usage_quotas").update(quota_update_data).eq("user_id", user_id).execute()
                 if quota_response.data:
@@ -599,11 +608,10 @@ async def update_user_plan(
                 # Cap at lifetime limit (if user already used more than lifetime limit, set to limit)
                 adjusted_tokens = min(current_tokens_used, lifetime_token_limit)
                 
-                now = utcnow()
                 quota_update_data = {
                     "weekly_tokens_used": adjusted_tokens,
                     "plan": plan.value,  # Update plan in quota
-                    "updated_at": now.isoformat()
+                    "updated_at": now_iso
                 }
                 
                 quota_response = supabase.table("usage_quotas").update(quota_update_data).eq("user_id", user_id).execute()
@@ -7,6 +7,7 @@ This ensures database operations (INSERT/UPDATE) won't be blocked by RLS policie
 """
 import os
 import sys
+from typing import Optional
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from pathlib import Path
@@ -26,29 +27,49 @@ SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY", "")
 # Prioritize SERVICE_ROLE_KEY, if not available use ANON_KEY (but will cause RLS errors)
 SUPABASE_KEY = SUPABASE_SERVICE_ROLE_KEY or SUPABASE_ANON_KEY
 
-# Debug: check which key is being used
-if SUPABASE_SERVICE_ROLE_KEY:
-    # Check if key is really service_role (not anon)
-    # service_role key's JWT payload should have role field as "service_role"
+
+def _jwt_role(key: str) -> Optional[str]:
+    """Return the role claim from a Supabase JWT key's payload, or None if it can't be decoded"""
     import base64
     import json
     try:
         # JWT format: header.payload.signature
-        parts = SUPABASE_SERVICE_ROLE_KEY.split('.')
-        if len(parts) >= 2:
-            # Decode payload (add padding if needed)
-            payload = parts[1]
-            payload += '=' * (4 - len(payload) % 4)  # Add padding
-            decoded = json.loads(base64.urlsafe_b64decode(payload))
-            role = decoded.get('role', 'unknown')
-            if role != 'service_role':
-                print(f"⚠️ WARNING: SUPABASE_SERVICE_ROLE_KEY appears to have role='{role}', not 'service_role'!")
-                print(f"   This will cause RLS policy violations. Please check your .env file.")
+        payload = key.split('.')[1]
+        # Over-padding is accepted by the decoder, so no need to compute the exact amount
+        return json.loads(base64.urlsafe_b64decode(payload + '==')).get('role', 'unknown')
     except Exception:
-        pass  # If decode fails, ignore (may be format issue)
+        return None  # If decode fails, ignore (may be format issue)
+
+
+# Debug: check which key is being used
+# service_role key's JWT payload should have role field as "service_role"
+if SUPABASE_SERVICE_ROLE_KEY:
+    role = _jwt_role(SUPABASE_SERVICE_ROLE_KEY)
+    if role is not None and role != 'service_role':
+        print(f"⚠️ WARNING: SUPABASE_SERVICE_ROLE_KEY appears to have role='{role}', not 'service_role'!")
+        print(f"   This will cause RLS policy violations. Please check your .env file.")
+
+
+def _create_client(key: str) -> Client:
+    """Create a Supabase client backed by a pooled HTTP/2 connection
+
+    Sequential PostgREST calls (e.g. update_user_plan's select + upsert) reuse one
+    kept-alive TLS session instead of paying a new handshake per request.
+    httpx is imported here so tests that stub out supabase don't need it installed.
+    """
+    import httpx
+    from supabase import ClientOptions
+
+    http_client = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60),
+        timeout=120.0,  # Same as postgrest's default client timeout
+    )
+    return create_client(SUPABASE_URL, key, options=ClientOptions(httpx_client=http_client))
+
 
 # Create Supabase client
-supabase_client: Client = create_client(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
+supabase_client: Client = _create_client(SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
 
 # Note: Module-level print removed to avoid Windows console encoding issues
 # Configuration check will be handled by logging system at application startup
@@ -2,30 +2,117 @@
 修复 plan 数据不一致的脚本
 从 Stripe 查询订阅的 price_id，然后更新数据库中的 plan
 """
+import asyncio
 import os
-import sys
-from pathlib import Path
-from dotenv import load_dotenv
+import traceback
+from types import MappingProxyType
 import stripe
 from backend.db_supabase import get_supabase_admin
 from backend.db_operations import update_user_plan
 from backend.db_models import PlanType
 
-# 加载环境变量
-backend_dir = Path(__file__).parent.resolve()
-env_path = backend_dir / ".env"
-load_dotenv(dotenv_path=env_path)
+# 环境变量已由 backend.db_supabase 在导入时从同一个 backend/.env 加载，这里不再重复加载
 
 # 配置 Stripe
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY", "")
+# 让 Stripe SDK 自动重试瞬时错误（网络错误、409、429 等），使用指数退避并遵循 Stripe-Should-Retry
+stripe.max_network_retries = 3
 
-# Stripe Price IDs 到 Plan 的映射（反向）
-STRIPE_PRICE_TO_PLAN = {
-    os.getenv("STRIPE_PRICE_NORMAL", "price_xxx"): PlanType.NORMAL,
-    os.getenv("STRIPE_PRICE_HIGH", "price_yyy"): PlanType.HIGH,
-    os.getenv("STRIPE_PRICE_ULTRA", "price_zzz"): PlanType.ULTRA,
-    os.getenv("STRIPE_PRICE_PREMIUM", "price_premium"): PlanType.PREMIUM,
-}
+# Stripe Price IDs 到 Plan 的映射（反向，只读）
+# 只包含已配置的 STRIPE_PRICE_* 环境变量，避免 "price_xxx" 之类的占位符混入错误日志
+STRIPE_PRICE_TO_PLAN = MappingProxyType({
+    os.environ[f"STRIPE_PRICE_{plan.value.upper()}"]: plan
+    for plan in (PlanType.NORMAL, PlanType.HIGH, PlanType.ULTRA, PlanType.PREMIUM)
+    if os.getenv(f"STRIPE_PRICE_{plan.value.upper()}")
+})
+
+
+# Stripe 并发查询上限（避免触发 Stripe 速率限制）
+STRIPE_CONCURRENCY = 10
+
+# 每页读取的用户数（PostgREST 默认单次最多返回 1000 行）
+PAGE_SIZE = 1000
+
+# 查询 Stripe 出错时 _resolve_plan 的返回值，与“无法确定 plan”（None）区分开，计入失败而不是跳过
+_RESOLVE_FAILED = object()
+
+
+def _iter_inconsistent_pages(supabase):
+    """分页读取有活跃订阅但 plan 是 'start' 的用户
+    
+    按 user_id 做 keyset 分页而不是 offset：修复过的用户会从结果集中消失，offset 分页会因此跳过行
+    """
+    last_user_id = None
+    while True:
+        query = supabase.table("user_plans").select("user_id,stripe_subscription_id").eq("subscription_status", "active").eq("plan", "start")
+        if last_user_id is not None:
+            query = query.gt("user_id", last_user_id)
+        rows = query.order("user_id").limit(PAGE_SIZE).execute().data
+        if not rows:
+            return
+        yield rows
+        if len(rows) < PAGE_SIZE:
+            return
+        last_user_id = rows[-1]["user_id"]
+
+
+async def _resolve_plan(user_plan, semaphore):
+    """从 Stripe 查询订阅对应的 plan，无法确定时返回 None，查询出错时返回 _RESOLVE_FAILED"""
+    user_id = user_plan["user_id"]
+    subscription_id = user_plan.get("stripe_subscription_id")
+    
+    if not subscription_id:
+        print(f"⚠️ User {user_id} has active subscription but no stripe_subscription_id")
+        return None
+    
+    try:
+        # 从 Stripe 查询订阅信息（Stripe SDK 是同步的，放到线程中执行以便并发查询）
+        async with semaphore:
+            subscription = await asyncio.to_thread(stripe.Subscription.retrieve, subscription_id)
+        
+        # 获取 price_id
+        if not subscription.items or not subscription.items.data:
+            print(f"⚠️ Subscription {subscription_id} has no items")
+            return None
+        
+        price_id = subscription.items.data[0].price.id
+        
+        # 根据 price_id 映射到 plan
+        plan = STRIPE_PRICE_TO_PLAN.get(price_id)
+        
+        if not plan:
+            print(f"⚠️ Unknown price_id: {price_id} for user {user_id}")
+            print(f"   Available price_ids: {list(STRIPE_PRICE_TO_PLAN.keys())}")
+            return None
+        
+        return plan
+        
+    except stripe.error.StripeError as e:
+        print(f"❌ Stripe error for subscription {subscription_id}: {e}")
+    except Exception as e:
+        print(f"❌ Error processing user {user_id}: {e}")
+        traceback.print_exc()
+    return _RESOLVE_FAILED
+
+
+async def _fix_user_plan(user_plan, semaphore):
+    """查询单个用户的订阅并更新其 plan，返回 'updated'、'skipped' 或 'failed'"""
+    plan = await _resolve_plan(user_plan, semaphore)
+    if plan is _RESOLVE_FAILED:
+        return "failed"
+    if plan is None:
+        return "skipped"
+    
+    user_id = user_plan["user_id"]
+    # 更新数据库（通过 update_user_plan，保留从 start 升级时的额度重置）
+    await update_user_plan(
+        user_id=user_id,
+        plan=plan,
+        subscription_status="active"
+    )
+    
+    print(f"✅ Updated user {user_id} plan from 'start' to '{plan.value}'")
+    return "updated"
 
 
 async def fix_plan_inconsistency():
@@ -34,63 +121,45 @@ async def fix_plan_inconsistency():
         print("❌ STRIPE_SECRET_KEY not configured")
         return
     
+    if not STRIPE_PRICE_TO_PLAN:
+        print("❌ No STRIPE_PRICE_* price IDs configured")
+        return
+    
     supabase = get_supabase_admin()
+    semaphore = asyncio.Semaphore(STRIPE_CONCURRENCY)
+    total = updated = skipped = failed = 0
     
-    # 查找所有有活跃订阅但 plan 是 'start' 的用户
-    response = supabase.table("user_plans").select("*").eq("subscription_status", "active").eq("plan", "start").execute()
+    # 逐页处理，避免一次性把所有行读入内存
+    for rows in _iter_inconsistent_pages(supabase):
+        total += len(rows)
+        print(f"🔍 Found {len(rows)} users with inconsistent plan data")
+        
+        # 每个用户独立处理：Stripe 查询并发进行，某个用户查询完成后立即更新数据库，不必等待所有查询结束
+        results = await asyncio.gather(
+            *(_fix_user_plan(user_plan, semaphore) for user_plan in rows),
+            return_exceptions=True
+        )
+        
+        # 单个用户失败不会中断其他用户，统一在这里输出错误
+        for user_plan, result in zip(rows, results):
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"❌ Error processing user {user_plan['user_id']}: {result}")
+                traceback.print_exception(type(result), result, result.__traceback__)
+            elif result == "failed":
+                failed += 1
+            elif result == "updated":
+                updated += 1
+            else:
+                skipped += 1
     
-    if not response.data:
+    if not total:
         print("✅ No inconsistent data found")
         return
     
-    print(f"🔍 Found {len(response.data)} users with inconsistent plan data")
-    
-    for user_plan in response.data:
-        user_id = user_plan["user_id"]
-        subscription_id = user_plan.get("stripe_subscription_id")
-        
-        if not subscription_id:
-            print(f"⚠️ User {user_id} has active subscription but no stripe_subscription_id")
-            continue
-        
-        try:
-            # 从 Stripe 查询订阅信息
-            subscription = stripe.Subscription.retrieve(subscription_id)
-            
-            # 获取 price_id
-            if not subscription.items or not subscription.items.data:
-                print(f"⚠️ Subscription {subscription_id} has no items")
-                continue
-            
-            price_id = subscription.items.data[0].price.id
-            print(f"🔍 User {user_id}: subscription_id={subscription_id}, price_id={price_id}")
-            
-            # 根据 price_id 映射到 plan
-            plan = STRIPE_PRICE_TO_PLAN.get(price_id)
-            
-            if not plan:
-                print(f"⚠️ Unknown price_id: {price_id} for user {user_id}")
-                print(f"   Available price_ids: {list(STRIPE_PRICE_TO_PLAN.keys())}")
-                continue
-            
-            # 更新数据库
-            await update_user_plan(
-                user_id=user_id,
-                plan=plan,
-                subscription_status="active"
-            )
-            
-            print(f"✅ Updated user {user_id} plan from 'start' to '{plan.value}'")
-            
-        except stripe.error.StripeError as e:
-            print(f"❌ Stripe error for subscription {subscription_id}: {e}")
-        except Exception as e:
-            print(f"❌ Error processing user {user_id}: {e}")
-            import traceback
-            traceback.print_exc()
-
+    # 汇总结果（跳过和失败的用户已在上面逐个输出原因）
+    print(f"📊 Done: {total} users checked, {updated} updated, {skipped} skipped, {failed} failed")
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(fix_plan_inconsistency())
 
@@ -17,16 +17,22 @@ if not is_production:
 # ========== Now can import other modules ==========
 from fastapi import FastAPI, HTTPException, File, UploadFile, Depends, Request, Header, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, RedirectResponse, HTMLResponse
+from fastapi.responses import Response, RedirectResponse, HTMLResponse, ORJSONResponse
 from pydantic import BaseModel
+import httpx
 import uvicorn
 import os
 import sys
-import json
+import logging
+import re
+import orjson
+import hashlib
 import platform
 from typing import Optional, Union
 from datetime import datetime
+from contextlib import asynccontextmanager
 import stripe  # Import stripe for error handling
 
 # Import existing modules - use absolute imports (backend as package)
@@ -52,38 +58,91 @@ from backend.payment_stripe import (
     cancel_subscription, downgrade_subscription, get_subscription_info
 )
 
-# ========== FastAPI App ==========
+# ========== Runtime environment ==========
+# Fixed for the lifetime of the process, so resolve once instead of per request
 
-app = FastAPI(
-    title="Desktop AI API",
-    description="Desktop AI Backend Service - Your AI assistant for daily usage, interviews, and productivity",
-    version="2.0.0"
-)
+# Set LOG_LEVEL=WARNING in production to turn the per-request debug lines into no-ops
+# Only the app logger is configured: the root logger stays at WARNING so httpx does not log every request URL
+logger = logging.getLogger("desktopai")
+_log_level = logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").strip().upper())
+logger.setLevel(_log_level if isinstance(_log_level, int) else logging.INFO)  # Unknown names fall back to INFO
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+logger.propagate = False
 
-# Add startup logs
-@app.on_event("startup")
-async def startup_event():
-    import os
-    is_vercel = os.getenv("VERCEL")
-    is_desktop = getattr(sys, 'frozen', False)  # Detect if it's a packaged desktop version
+_LINE_BREAK_OR_TAB = re.compile(r"[\n\r\t]")
+
+def clean_url(s: str | None) -> str:
+    """Clean URL: strip whitespace"""
+    return (s or "").strip()
+
+def require_clean_url(name: str, s: str | None) -> str:
+    """Require clean URL: strip and validate no internal whitespace"""
+    v = clean_url(s)
+    if not v:
+        return v
+    # Critical: prohibit any internal whitespace (prevent multi-line/indentation)
+    if _LINE_BREAK_OR_TAB.search(v):
+        raise ValueError(f"{name} contains whitespace: {repr(s)}")
+    return v
+
+def env_url(name: str, default: str) -> str:
+    """Validated URL from an environment variable; a malformed value is logged and replaced by the default
     
+    Read once at import, so one bad value must not stop the whole app from loading
+    """
+    try:
+        return require_clean_url(name, os.getenv(name, default))
+    except ValueError as e:
+        logger.error("❌ %s; falling back to %s", e, default)
+        return default
+
+IS_VERCEL = bool(os.getenv("VERCEL"))
+IS_DESKTOP = getattr(sys, 'frozen', False)  # Packaged desktop version
+VERCEL_API_URL = env_url("VERCEL_API_URL", "https://www.desktopai.org")
+FRONTEND_URL = env_url("FRONTEND_URL", "https://www.desktopai.org") or "https://www.desktopai.org"
+
+# ========== FastAPI App ==========
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup logs and app-scoped resources, released on shutdown"""
     print("=" * 60)
     print("🚀 FastAPI application starting")
-    if is_vercel:
+    if IS_VERCEL:
         print(f"   Environment: Vercel (Cloud)")
         print(f"   ✅ All API Keys in cloud")
-    elif is_desktop:
+    elif IS_DESKTOP:
         print(f"   Environment: Desktop (Desktop version)")
         print(f"   ⚠️  Desktop mode: No configuration or API Keys included")
         print(f"   ✅ All API requests will be forwarded to Vercel (including auth, database, AI, payment)")
-        vercel_url = os.getenv("VERCEL_API_URL", "https://www.desktopai.org")
-        print(f"   Cloud API: {vercel_url}")
+        print(f"   Cloud API: {VERCEL_API_URL}")
         print(f"   ✅ Desktop version does not directly connect to Supabase or any external services")
     else:
         print(f"   Environment: Local (Local development)")
         print(f"   OPENAI_API_KEY configured: {bool(os.getenv('OPENAI_API_KEY'))}")
     print("=" * 60)
 
+    # Shared client for forwarding desktop requests to Vercel: keeps TLS connections alive across requests
+    app.state.http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=200),
+    )
+    try:
+        yield
+    finally:
+        await app.state.http_client.aclose()
+
+
+app = FastAPI(
+    title="Desktop AI API",
+    description="Desktop AI Backend Service - Your AI assistant for daily usage, interviews, and productivity",
+    version="2.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+
 # Configure CORS
 # Note: When allow_credentials=True, cannot use allow_origins=["*"]
 # Must explicitly specify allowed origins, otherwise browser will reject cross-origin requests with cookies
@@ -96,24 +155,81 @@ origins = [
     None,                         # Allow requests without Origin (Electron apps, file:// protocol)
 ]
 
+class OriginSetCORSMiddleware(CORSMiddleware):
+    """CORSMiddleware that matches Origin against a prebuilt set instead of scanning the list
+    
+    Requests without an Origin header never reach is_allowed_origin (Starlette passes them
+    straight through), so the None entry is only dropped from the set
+    """
+
+    def __init__(self, app, allow_origins=(), **kwargs):
+        super().__init__(app, allow_origins=allow_origins, **kwargs)
+        self.allow_origin_set = frozenset(o for o in allow_origins if o)
+
+    def is_allowed_origin(self, origin: str) -> bool:
+        return origin in self.allow_origin_set or super().is_allowed_origin(origin)
+
 app.add_middleware(
-    CORSMiddleware,
+    OriginSetCORSMiddleware,
     allow_origins=origins,        # ⭐ Cannot use "*", must explicitly specify (None allows no Origin)
     allow_credentials=True,       # ⭐ Must be True to allow cookies
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # Explicit lists (the app only serves GET/POST) instead of "*"
+    # Headers sent by the web/Electron frontend; Cache-Control and Pragma come from the Plans page
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["Authorization", "Content-Type", "Cache-Control", "Pragma", "X-Requested-With"],
+    max_age=86400,                # Let browsers cache preflight results for a day (Starlette default: 600s)
 )
 
+# Compress JSON/HTML bodies (anon keys, tokens, chat answers); added after CORS so it wraps the CORS response
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
+
+# ========== Cached responses ==========
+# Bodies that cannot change while the process runs are serialized once and served with an ETag
+
+def make_etag(content: bytes) -> str:
+    """Weak ETag for a response body
+    
+    Weak because GZipMiddleware may send the same body gzip-encoded, which is a different byte sequence
+    """
+    return f'W/"{hashlib.md5(content).hexdigest()}"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an ETag against the entity tags listed in If-None-Match"""
+    opaque_tag = etag.removeprefix("W/")
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == opaque_tag:
+            return True
+    return False
+
+def conditional_response(request: Request, content: bytes, etag: str, media_type: str, cache_control: str) -> Response:
+    """Return content with an ETag, or an empty 304 if the client already has this version"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("If-None-Match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
+
 # ========== Static file service (Desktop version) ==========
 # Only provide static file service in desktop mode
 
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles for Vite build assets: file names are content-hashed, so browsers can cache them without revalidating"""
+
+    def file_response(self, *args, **kwargs) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        # Assets may be gzip-encoded by GZipMiddleware, so the validator must be weak
+        etag = response.headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            response.headers["etag"] = f"W/{etag}"
+        return response
+
 def find_ui_directory():
     """Find UI directory"""
-    import sys
     possible_dirs = []
     
     # If it's a packaged exe, UI may be in multiple locations
-    if getattr(sys, 'frozen', False):
+    if IS_DESKTOP:
         exe_dir = Path(sys.executable).parent.resolve()
         # 1. ui/ folder in same directory as exe
         possible_dirs.append(exe_dir / "ui")
@@ -134,13 +250,18 @@ def find_ui_directory():
 
 # Find and set UI directory
 ui_directory = find_ui_directory()
+INDEX_HTML_PATH = ui_directory / "index.html" if ui_directory else None
 if ui_directory:
     print(f"📁 Detected UI directory: {ui_directory}")
     
+    # The UI bundle does not change while running: read index.html once and serve it from memory
+    INDEX_HTML_BYTES = INDEX_HTML_PATH.read_bytes()
+    INDEX_HTML_ETAG = make_etag(INDEX_HTML_BYTES)
+    
     # Mount static resources directory
     assets_dir = ui_directory / "assets"
     if assets_dir.exists():
-        app.mount("/assets", StaticFiles(directory=str(assets_dir)), name="assets")
+        app.mount("/assets", ImmutableStaticFiles(directory=str(assets_dir)), name="assets")
         print(f"✅ Mounted static resources: /assets")
 else:
     print("ℹ️  UI directory not detected, API service only")
@@ -191,6 +312,36 @@ class CheckoutRequest(BaseModel):
 
 # ========== Helper Functions ==========
 
+# Upstream headers relayed with forwarded Vercel responses (cookies, caching, auth challenges, redirects)
+RELAYED_HEADERS = ("set-cookie", "cache-control", "etag", "www-authenticate", "location")
+
+
+def passthrough_response(response: httpx.Response) -> Response:
+    """Relay a response forwarded from Vercel as-is (status, body, relayed headers)
+    
+    Skips decoding the upstream JSON and re-encoding it through response_model
+    """
+    relayed = Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type", "application/json")
+    )
+    for name in RELAYED_HEADERS:
+        # get_list keeps every Set-Cookie value instead of folding them into one
+        for value in response.headers.get_list(name):
+            relayed.headers.append(name, value)
+    return relayed
+
+
+def index_html_response(request: Request) -> Response:
+    """Serve the cached UI index.html
+    
+    no-cache makes the browser revalidate (a cheap 304) instead of keeping a stale
+    index.html that points at hashed assets from a previous desktop build
+    """
+    return conditional_response(request, INDEX_HTML_BYTES, INDEX_HTML_ETAG, "text/html", "no-cache")
+
+
 async def get_api_client_for_user(user_id: str, plan: PlanType) -> tuple[AsyncOpenAI, str]:
     """Get corresponding OpenAI client and model based on user Plan
     
@@ -226,35 +377,25 @@ async def get_api_client_for_user(user_id: str, plan: PlanType) -> tuple[AsyncOp
 
 # ========== API Endpoints ==========
 
+ROOT_INFO_JSON = orjson.dumps({
+    "status": "running",
+    "message": "Desktop AI API v2.0",
+    "version": "2.0.0"
+})
+
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Root path - health check or return UI"""
-    # Try to find UI directory
-    ui_dir = None
-    if getattr(sys, 'frozen', False):
-        exe_dir = Path(sys.executable).parent.resolve()
-        ui_dir = exe_dir / "ui"
-    else:
-        backend_dir = Path(__file__).parent.resolve()
-        project_root = backend_dir.parent.resolve()
-        ui_dir = project_root / "ui"
-    
-    if ui_dir and (ui_dir / "index.html").exists():
-        return FileResponse(str(ui_dir / "index.html"))
+    # UI directory was resolved once at import (see find_ui_directory)
+    if INDEX_HTML_PATH:
+        return index_html_response(request)
     else:
         # Otherwise return API information
-        return {
-            "status": "running",
-            "message": "Desktop AI API v2.0",
-            "version": "2.0.0"
-        }
+        return Response(content=ROOT_INFO_JSON, media_type="application/json")
 
 
-@app.get("/health")
-@app.get("/api/health")  # Support both /health and /api/health
-async def health_check():
-    """Health check endpoint - includes environment variable status"""
-    is_vercel = os.getenv("VERCEL")
+def build_health_json() -> bytes:
+    """Health body: environment variable status"""
     env_status = {
         "OPENAI_API_KEY": bool(os.getenv("OPENAI_API_KEY")),
         "SUPABASE_URL": bool(os.getenv("SUPABASE_URL")),
@@ -266,13 +407,24 @@ async def health_check():
     
     all_configured = all(env_status.values())
     
-    return {
+    return orjson.dumps({
         "status": "healthy" if all_configured else "warning",
-        "environment": "Vercel" if is_vercel else "Local",
+        "environment": "Vercel" if IS_VERCEL else "Local",
         "message": "All environment variables configured" if all_configured else "Some environment variables are missing",
         "environment_variables": env_status,
         "ready": all_configured
-    }
+    })
+
+# Environment variables are only read at startup, so the health body is built once
+HEALTH_JSON = build_health_json()
+HEALTH_ETAG = make_etag(HEALTH_JSON)
+
+@app.get("/health")
+@app.get("/api/health")  # Support both /health and /api/health
+async def health_check(request: Request):
+    """Health check endpoint - includes environment variable status"""
+    # no-cache: monitors must still reach this process, the ETag only saves the body
+    return conditional_response(request, HEALTH_JSON, HEALTH_ETAG, "application/json", "no-cache")
 
 
 # ========== Authentication related API ==========
@@ -281,22 +433,19 @@ async def health_check():
 async def register(user_data: UserRegister, http_request: Request):
     """User registration"""
     # If desktop version, forward to Vercel
-    is_desktop = getattr(sys, 'frozen', False)
-    if is_desktop:
-        import httpx
-        vercel_api_url = os.getenv("VERCEL_API_URL", "https://www.desktopai.org")
-        async with httpx.AsyncClient() as http_client:
-            try:
-                response = await http_client.post(
-                    f"{vercel_api_url}/api/register",
-                    json={"email": user_data.email, "password": user_data.password},
-                    headers={"Content-Type": "application/json"},
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPError as e:
-                raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
+    if IS_DESKTOP:
+        http_client = http_request.app.state.http_client
+        try:
+            response = await http_client.post(
+                f"{VERCEL_API_URL}/api/register",
+                json={"email": user_data.email, "password": user_data.password},
+                headers={"Content-Type": "application/json"},
+                timeout=30.0
+            )
+            response.raise_for_status()
+            return passthrough_response(response)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
     
     # Non-desktop version: normal processing
     return await register_user(user_data.email, user_data.password)
@@ -306,59 +455,43 @@ async def register(user_data: UserRegister, http_request: Request):
 async def login(user_data: UserLogin, http_request: Request):
     """User login"""
     # If desktop version, forward to Vercel
-    is_desktop = getattr(sys, 'frozen', False)
-    if is_desktop:
-        import httpx
-        vercel_api_url = os.getenv("VERCEL_API_URL", "https://www.desktopai.org")
-        async with httpx.AsyncClient() as http_client:
-            try:
-                response = await http_client.post(
-                    f"{vercel_api_url}/api/login",
-                    json={"email": user_data.email, "password": user_data.password},
-                    headers={"Content-Type": "application/json"},
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPError as e:
-                raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
+    if IS_DESKTOP:
+        http_client = http_request.app.state.http_client
+        try:
+            response = await http_client.post(
+                f"{VERCEL_API_URL}/api/login",
+                json={"email": user_data.email, "password": user_data.password},
+                headers={"Content-Type": "application/json"},
+                timeout=30.0
+            )
+            response.raise_for_status()
+            return passthrough_response(response)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
     
     # Non-desktop version: normal processing
     return await login_user(user_data.email, user_data.password)
 
 
+SUPABASE_CONFIG = {
+    "supabase_url": os.getenv("SUPABASE_URL", ""),
+    "supabase_anon_key": os.getenv("SUPABASE_ANON_KEY", "")
+}
+SUPABASE_CONFIG_JSON = orjson.dumps(SUPABASE_CONFIG)
+SUPABASE_CONFIG_ETAG = make_etag(SUPABASE_CONFIG_JSON)
+
 @app.get("/api/config/supabase", tags=["Configuration"])
-async def get_supabase_config():
+async def get_supabase_config(request: Request):
     """Get Supabase configuration (for frontend OAuth use)"""
-    supabase_url = os.getenv("SUPABASE_URL", "")
-    supabase_anon_key = os.getenv("SUPABASE_ANON_KEY", "")
-    
-    if not supabase_url or not supabase_anon_key:
+    if not all(SUPABASE_CONFIG.values()):
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Supabase configuration missing"
         )
     
-    return {
-        "supabase_url": supabase_url,
-        "supabase_anon_key": supabase_anon_key
-    }
+    return conditional_response(request, SUPABASE_CONFIG_JSON, SUPABASE_CONFIG_ETAG, "application/json", "public, max-age=300")
 
 
-def clean_url(s: str | None) -> str:
-    """Clean URL: strip whitespace"""
-    return (s or "").strip()
-
-def require_clean_url(name: str, s: str | None) -> str:
-    """Require clean URL: strip and validate no internal whitespace"""
-    v = clean_url(s)
-    if not v:
-        return v
-    # Critical: prohibit any internal whitespace (prevent multi-line/indentation)
-    if v != v.strip() or "\n" in v or "\r" in v or "\t" in v:
-        raise ValueError(f"{name} contains whitespace: {repr(s)}")
-    return v
-
 @app.get("/api/auth/google/url", tags=["Authentication"])
 async def get_google_oauth_url_endpoint(
     redirect_to: Optional[str] = None, 
@@ -375,15 +508,12 @@ async def get_google_oauth_url_endpoint(
     
     if is_desktop_platform:
         # Force desktop platform to use Vercel backend callback URL
-        vercel_base_url = require_clean_url("VERCEL_API_URL fallback", os.getenv("VERCEL_API_URL", "https://www.desktopai.org"))
-        redirect_to = f"{vercel_base_url}/api/auth/callback?platform=desktop"
+        redirect_to = f"{VERCEL_API_URL}/api/auth/callback?platform=desktop"
         print(f"🔐 Desktop platform detected: forcing redirect_to to Vercel backend: {redirect_to}")
     else:
         # Force normalization: clean all URL-related values for web platform
+        # (FRONTEND_URL was already validated at import)
         try:
-            # Clean FRONTEND_URL fallback
-            frontend_url_fallback = require_clean_url("FRONTEND_URL fallback", "https://www.desktopai.org")
-            
             # Clean redirect_to from request
             if redirect_to is not None:
                 redirect_to = require_clean_url("redirect_to parameter", redirect_to)
@@ -391,11 +521,6 @@ async def get_google_oauth_url_endpoint(
                 u = urlparse(redirect_to)
                 if u.scheme not in ("http", "https") or not u.netloc:
                     raise ValueError(f"Invalid redirect_to: {redirect_to}")
-            
-            # Clean FRONTEND_URL environment variable
-            frontend_url_env = os.getenv("FRONTEND_URL")
-            if frontend_url_env:
-                frontend_url_env = require_clean_url("FRONTEND_URL env", frontend_url_env)
         except ValueError as e:
             print(f"❌ URL validation error: {e}")
             raise HTTPException(
@@ -411,62 +536,59 @@ async def get_google_oauth_url_endpoint(
                 redirect_to = require_clean_url("redirect_to from request", redirect_to)
     
     # If desktop version (local FastAPI), forward to Vercel
-    is_desktop_local = getattr(sys, 'frozen', False)
-    if is_desktop_local:
-        import httpx
-        vercel_api_url = require_clean_url("VERCEL_API_URL", os.getenv("VERCEL_API_URL", "https://www.desktopai.org"))
-        async with httpx.AsyncClient() as http_client:
-            try:
-                params = {"platform": "desktop"}  # Always pass platform=desktop
-                if redirect_to:
-                    params["redirect_to"] = redirect_to
-                response = await http_client.get(
-                    f"{vercel_api_url}/api/auth/google/url",
-                    params=params,
-                    timeout=30.0
-                )
-                
-                # Check response status before parsing JSON
-                if response.status_code != 200:
-                    error_text = response.text
-                    try:
-                        error_json = response.json()
-                        error_detail = error_json.get("detail", error_json.get("error", error_text))
-                    except:
-                        error_detail = error_text
-                    
-                    print(f"❌ Vercel API returned error: {response.status_code} - {error_detail}")
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Cloud API error: {error_detail}"
-                    )
-                
-                data = response.json()
-                # Verify returned data format
-                if not isinstance(data, dict) or 'url' not in data:
-                    raise HTTPException(
-                        status_code=502, 
-                        detail=f"Cloud API returned invalid format: {data}"
-                    )
-                return data
-            except HTTPException:
-                raise
-            except httpx.HTTPStatusError as e:
-                # Handle HTTP status errors (4xx, 5xx)
-                error_text = e.response.text if hasattr(e.response, 'text') else str(e)
+    if IS_DESKTOP:
+        http_client = http_request.app.state.http_client
+        try:
+            params = {"platform": "desktop"}  # Always pass platform=desktop
+            if redirect_to:
+                params["redirect_to"] = redirect_to
+            response = await http_client.get(
+                f"{VERCEL_API_URL}/api/auth/google/url",
+                params=params,
+                timeout=30.0
+            )
+            
+            # Check response status before parsing JSON
+            if response.status_code != 200:
+                error_text = response.text
                 try:
-                    error_json = e.response.json()
+                    error_json = orjson.loads(response.content)
                     error_detail = error_json.get("detail", error_json.get("error", error_text))
                 except:
                     error_detail = error_text
-                print(f"❌ Vercel API HTTP error: {e.response.status_code} - {error_detail}")
+                
+                print(f"❌ Vercel API returned error: {response.status_code} - {error_detail}")
                 raise HTTPException(
-                    status_code=e.response.status_code,
+                    status_code=response.status_code,
                     detail=f"Cloud API error: {error_detail}"
                 )
-            except httpx.HTTPError as e:
-                print(f"❌ Unable to connect to Vercel API: {e}")
-                raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
+            
+            data = orjson.loads(response.content)
+            # Verify returned data format
+            if not isinstance(data, dict) or 'url' not in data:
+                raise HTTPException(
+                    status_code=502, 
+                    detail=f"Cloud API returned invalid format: {data}"
+                )
+            return data
+        except HTTPException:
+            raise
+        except httpx.HTTPStatusError as e:
+            # Handle HTTP status errors (4xx, 5xx)
+            error_text = e.response.text if hasattr(e.response, 'text') else str(e)
+            try:
+                error_json = orjson.loads(e.response.content)
+                error_detail = error_json.get("detail", error_json.get("error", error_text))
+            except:
+                error_detail = error_text
+            print(f"❌ Vercel API HTTP error: {e.response.status_code} - {error_detail}")
+            raise HTTPException(
+                status_code=e.response.status_code,
+                detail=f"Cloud API error: {error_detail}"
+            )
+        except httpx.HTTPError as e:
+            print(f"❌ Unable to connect to Vercel API: {e}")
+            raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
     
     # Vercel backend processing: use the redirect_to we set above
     result = await get_google_oauth_url(redirect_to)
@@ -495,12 +617,12 @@ async def oauth_callback(request: Request, code: Optional[str] = None, state: Op
     code = request.query_params.get("code", code)
     state = request.query_params.get("state", state)
     
-    print(f"🔍 /api/auth/callback received request: platform={platform}, has_code={bool(code)}, has_state={bool(state)}")
+    logger.debug("🔍 /api/auth/callback received request: platform=%s, has_code=%s, has_state=%s", platform, bool(code), bool(state))
     
     # CRITICAL FIX: For desktop platform, Supabase redirects with tokens in hash, not code in query
     # Return HTML that extracts tokens from hash and sends via postMessage
     if platform == "desktop":
-        print(f"🔍 Desktop platform detected: returning HTML to extract tokens from hash")
+        logger.debug("🔍 Desktop platform detected: returning HTML to extract tokens from hash")
         # Desktop callback HTML: extracts tokens from window.location.hash and sends via postMessage
         desktop_callback_html = """
 <!doctype html>
@@ -597,28 +719,26 @@ async def oauth_callback(request: Request, code: Optional[str] = None, state: Op
         return HTMLResponse(content=desktop_callback_html)
     
     # If desktop version (local FastAPI), forward to Vercel
-    is_desktop_local = getattr(sys, 'frozen', False)
-    if is_desktop_local:
-        import httpx
-        vercel_api_url = os.getenv("VERCEL_API_URL", "https://www.desktopai.org")
-        async with httpx.AsyncClient() as http_client:
-            try:
-                params = {"platform": platform or "web"}
-                if code:
-                    params["code"] = code
-                if state:
-                    params["state"] = state
-                response = await http_client.get(
-                    f"{vercel_api_url}/api/auth/callback",
-                    params=params,
-                    timeout=30.0
-                )
+    if IS_DESKTOP:
+        http_client = request.app.state.http_client
+        try:
+            params = {"platform": platform or "web"}
+            if code:
+                params["code"] = code
+            if state:
+                params["state"] = state
+            response = await http_client.get(
+                f"{VERCEL_API_URL}/api/auth/callback",
+                params=params,
+                timeout=30.0
+            )
+            # Relay the cloud callback (redirect and all) to the browser; only 4xx/5xx are failures
+            if response.is_error:
                 response.raise_for_status()
-                # Return HTML for Electron, or response content for web
-                return HTMLResponse(content=response.text) if platform == "desktop" else response
-            except httpx.HTTPError as e:
-                print(f"❌ Desktop version forwarding failed: {e}")
-                raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
+            return passthrough_response(response)
+        except httpx.HTTPError as e:
+            logger.error("❌ Desktop version forwarding failed: %s", e)
+            raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
     
     # Web browser callback: requires code parameter for exchange
     if not code:
@@ -644,7 +764,7 @@ async def oauth_callback(request: Request, code: Optional[str] = None, state: Op
         # Create Supabase client with SERVICE_ROLE_KEY (bypasses RLS and can exchange code)
         supabase = create_client(supabase_url, supabase_service_key)
         
-        print(f"🔍 Exchanging OAuth code for session using service key: {code[:20]}...")
+        logger.debug("🔍 Exchanging OAuth code for session using service key: %s...", code[:20])
         
         # Use Supabase SDK to exchange code for session (works with service key, no PKCE needed)
         response = supabase.auth.exchange_code_for_session({
@@ -661,12 +781,10 @@ async def oauth_callback(request: Request, code: Optional[str] = None, state: Op
         access_token = response.session.access_token
         refresh_token = response.session.refresh_token
         
-        print(f"✅ OAuth callback successful, User ID: {user.id}, Email: {user.email}")
+        logger.info("✅ OAuth callback successful, User ID: %s, Email: %s", user.id, user.email)
         
         # For Web browser: set cookie and redirect to success page
-        frontend_url_env = os.getenv("FRONTEND_URL")
-        frontend_url = require_clean_url("FRONTEND_URL env", frontend_url_env) if frontend_url_env else require_clean_url("FRONTEND_URL fallback", "https://www.desktopai.org")
-        redirect_url = f"{frontend_url}/auth/success"
+        redirect_url = f"{FRONTEND_URL}/auth/success"
         
         # Create redirect response and set session cookie
         response_obj = RedirectResponse(url=redirect_url, status_code=302)
@@ -699,71 +817,18 @@ async def oauth_callback(request: Request, code: Optional[str] = None, state: Op
                 path="/",
             )
         
-        print(f"✅ Session cookie set (origin: {origin}, is_localhost: {is_localhost}), redirecting to: {redirect_url}")
+        logger.info("✅ Session cookie set (origin: %s, is_localhost: %s), redirecting to: %s", origin, is_localhost, redirect_url)
         
         return response_obj
             
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_trace = traceback.format_exc()
-        print(f"❌ OAuth callback error: {e}")
-        print(f"❌ Error traceback:\n{error_trace}")
+        logger.exception("❌ OAuth callback error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"OAuth callback processing failed: {str(e)}"
         )
-        
-        # Debug logs
-        print(f"🔍 OAuth callback response type: {type(response)}")
-        
-        if not response.user:
-            print(f"❌ OAuth callback failed: response.user is empty")
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="OAuth callback failed: Unable to get user information"
-            )
-        
-        if not response.session:
-            print(f"❌ OAuth callback failed: response.session is empty")
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="OAuth callback failed: Unable to get session information"
-            )
-        
-        # Return token information - use same method as login_user
-        token = Token(
-            access_token=response.session.access_token,
-            refresh_token=response.session.refresh_token,
-            user={
-                "id": response.user.id,
-                "email": response.user.email
-            }
-        )
-        
-        return token
-    except HTTPException:
-        raise
-    except AttributeError as e:
-        import traceback
-        error_trace = traceback.format_exc()
-        print(f"❌ OAuth callback attribute error: {e}")
-        print(f"Error stack:\n{error_trace}")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"OAuth callback processing failed: Response format incorrect - {str(e)}"
-        )
-    except Exception as e:
-        import traceback
-        error_trace = traceback.format_exc()
-        print(f"❌ OAuth callback processing error: {e}")
-        print(f"Error type: {type(e)}")
-        print(f"Error stack:\n{error_trace}")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"OAuth callback processing failed: {str(e)}"
-        )
 
 
 @app.post("/api/auth/exchange-code", tags=["Authentication"])
@@ -773,263 +838,12 @@ async def exchange_oauth_code(request: Request):
     DEPRECATED: OAuth is now handled via /api/auth/callback with service key.
     This endpoint is kept for backward compatibility but returns 410 Gone.
     """
-    print(f"⚠️ /api/auth/exchange-code: LEGACY endpoint called - this should not be used anymore")
-    print(f"⚠️ OAuth is now handled via /api/auth/callback with service key")
+    logger.warning("⚠️ /api/auth/exchange-code: LEGACY endpoint called - this should not be used anymore")
+    logger.warning("⚠️ OAuth is now handled via /api/auth/callback with service key")
     raise HTTPException(
         status_code=410,  # Gone - indicates the resource is no longer available
         detail="This endpoint is deprecated. OAuth is now handled via /api/auth/callback. Please update your client code."
     )
-    
-    # If desktop version, forward to Vercel
-    is_desktop = getattr(sys, 'frozen', False)
-    if is_desktop:
-        import httpx
-        vercel_api_url = os.getenv("VERCEL_API_URL", "https://www.desktopai.org")
-        async with httpx.AsyncClient() as http_client:
-            try:
-                body = await request.json()
-                print(f"🔐 /api/auth/exchange-code: Forwarding to Vercel (desktop version)")
-                response = await http_client.post(
-                    f"{vercel_api_url}/api/auth/exchange-code",
-                    json=body,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                result = response.json()
-                print(f"✅ /api/auth/exchange-code: Successfully exchanged code, user: {result.get('user', {}).get('email', 'N/A')}")
-                return result
-            except httpx.HTTPError as e:
-                print(f"❌ /api/auth/exchange-code: Failed to forward to Vercel: {e}")
-                raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
-    
-    # Non-desktop version: normal processing
-    try:
-        body = await request.json()
-        print(f"🔐 /api/auth/exchange-code: Received request body keys: {list(body.keys())}")
-        print(f"🔐 /api/auth/exchange-code: Full request body (sanitized): {json.dumps({k: (v[:20] + '...' if isinstance(v, str) and len(v) > 20 else ('***' if k == 'code_verifier' and v else v)) for k, v in body.items()}, indent=2)}")
-        
-        code = body.get("code")
-        state = body.get("state")  # Get state for flow_state_id (fallback only)
-        code_verifier = body.get("code_verifier")  # REQUIRED for PKCE flow
-        
-        # Validate code
-        if not code or not isinstance(code, str) or not code.strip():
-            raise HTTPException(status_code=400, detail="Missing or invalid code parameter")
-        
-        # PRIORITY 1: Use code_verifier from request body (preferred - stateless approach)
-        # This works in Vercel/serverless environments where memory storage doesn't persist
-        # ✅ If code_verifier exists, use it directly without accessing flow_state dictionary
-        if code_verifier and isinstance(code_verifier, str) and code_verifier.strip():
-            code_verifier = code_verifier.strip()
-            print(f"✅ /api/auth/exchange-code: Using code_verifier from request body (length: {len(code_verifier)})")
-            print(f"✅ /api/auth/exchange-code: Skipping flow_state dictionary lookup (using provided code_verifier)")
-        else:
-            # PRIORITY 2: Fallback to memory storage (ONLY works in single-process environments)
-            # Note: This will fail in Vercel/serverless as different requests may hit different instances
-            # Only attempt this if code_verifier is truly missing
-            print(f"⚠️ /api/auth/exchange-code: code_verifier not found in request body, attempting fallback...")
-            if state:
-                print(f"⚠️ /api/auth/exchange-code: Attempting fallback to memory storage (may fail in serverless)...")
-                try:
-                    # Decode state JWT to get flow_state_id
-                    import base64
-                    parts = state.split('.')
-                    if len(parts) >= 2:
-                        # Decode payload (second part)
-                        payload_b64 = parts[1]
-                        # Add padding if needed
-                        payload_b64 += '=' * (4 - len(payload_b64) % 4)
-                        payload_bytes = base64.urlsafe_b64decode(payload_b64)
-                        payload = json.loads(payload_bytes)
-                        flow_state_id = payload.get('flow_state_id')
-                        if flow_state_id:
-                            from backend.auth_supabase import _pkce_storage
-                            stored_verifier = _pkce_storage.get(flow_state_id)
-                            if stored_verifier:
-                                code_verifier = stored_verifier
-                                print(f"✅ Retrieved code_verifier from memory storage using flow_state_id: {flow_state_id[:20]}...")
-                            else:
-                                print(f"❌ No code_verifier found in memory storage for flow_state_id: {flow_state_id[:20]}...")
-                                print(f"❌ This is expected in Vercel/serverless environments where requests may hit different instances")
-                except Exception as e:
-                    print(f"⚠️ Failed to extract flow_state_id from state: {e}")
-        
-        # Final validation: code_verifier is REQUIRED for PKCE flow
-        if not code_verifier or not isinstance(code_verifier, str) or not code_verifier.strip():
-            error_detail = {
-                "code": "code_verifier_missing",
-                "msg": "code_verifier is required for PKCE OAuth flow. Please ensure the client sends code_verifier in the request body.",
-                "hint": "In Electron environment, code_verifier should be retrieved from localStorage and included in the exchange-code request."
-            }
-            print(f"❌ /api/auth/exchange-code: ERROR - code_verifier is missing or invalid!")
-            print(f"❌ Error detail: {json.dumps(error_detail, indent=2)}")
-            raise HTTPException(status_code=400, detail=error_detail)
-        
-        # Use Supabase Python SDK to exchange code for session
-        # Note: OAuth exchange should use ANON_KEY, not SERVICE_ROLE_KEY
-        import os
-        from supabase import create_client
-        
-        supabase_url = os.getenv("SUPABASE_URL", "")
-        supabase_anon_key = os.getenv("SUPABASE_ANON_KEY", "")
-        
-        if not supabase_url or not supabase_anon_key:
-            raise HTTPException(
-                status_code=500,
-                detail="Supabase configuration missing: SUPABASE_URL or SUPABASE_ANON_KEY not set"
-            )
-        
-        # Create Supabase client with ANON_KEY for OAuth (not SERVICE_ROLE_KEY)
-        supabase = create_client(supabase_url, supabase_anon_key)
-        
-        print(f"🔐 Exchanging OAuth code for session (code: {code[:20]}...)")
-        if code_verifier:
-            print(f"🔐 Using PKCE flow with code_verifier (length: {len(code_verifier)})")
-        else:
-            print(f"🔐 Using non-PKCE flow (no code_verifier)")
-        
-        # Exchange code for session
-        # Note: Supabase Python SDK may have issues with PKCE, so we'll try direct REST API call
-        if code_verifier:
-            # Use PKCE flow - try direct REST API call instead of SDK
-            import httpx
-            print(f"🔐 Calling Supabase REST API directly for PKCE exchange")
-            async with httpx.AsyncClient() as client:
-                token_url = f"{supabase_url}/auth/v1/token?grant_type=pkce"
-                
-                # Validate code and code_verifier before sending (state is optional for now)
-                if not code or not isinstance(code, str) or not code.strip():
-                    raise HTTPException(status_code=400, detail=f"Invalid code: code is empty or not a string (type: {type(code)})")
-                if not code_verifier or not isinstance(code_verifier, str) or not code_verifier.strip():
-                    raise HTTPException(status_code=400, detail=f"Invalid code_verifier: code_verifier is empty or not a string (type: {type(code_verifier)})")
-                
-                # Strip whitespace to ensure clean values
-                code = code.strip()
-                code_verifier = code_verifier.strip()
-                # State is kept for logging but not used in token request for now
-                if state:
-                    state = state.strip()
-                
-                print(f"🔐 Token URL: {token_url}")
-                print(f"🔐 Code (after strip): {code[:20]}... (length: {len(code)}, type: {type(code)})")
-                print(f"🔐 Code verifier (after strip): {code_verifier[:20]}... (length: {len(code_verifier)}, type: {type(code_verifier)})")
-                if state:
-                    print(f"🔐 State (after strip): {state[:50]}... (length: {len(state)}, type: {type(state)})")
-                print(f"🔐 SUPABASE_URL: {supabase_url[:50]}...")
-                print(f"🔐 SUPABASE_ANON_KEY: {'***' + supabase_anon_key[-10:] if supabase_anon_key else 'NOT SET'}")
-                
-                # Supabase PKCE token exchange requires "auth_code" parameter (not "code")
-                # The grant_type=pkce endpoint expects "auth_code" in the JSON body
-                # Start with minimal required fields: auth_code and code_verifier only
-                # auth_flow_type and auth_flow_state may not be needed and could cause issues
-                token_data = {
-                    "auth_code": code,  # Supabase PKCE endpoint expects "auth_code" key
-                    "code_verifier": code_verifier
-                    # Removed auth_flow_type and auth_flow_state - test with minimal fields first
-                }
-                print(f"🔐 Token data keys: {list(token_data.keys())}")
-                print(f"🔐 Request body (full JSON): {json.dumps(token_data, indent=2)}")
-                # Preview with truncated values
-                preview_data = {}
-                for k, v in token_data.items():
-                    if isinstance(v, str):
-                        preview_data[k] = v[:20] + "..." if len(v) > 20 else v
-                    else:
-                        preview_data[k] = v
-                print(f"🔐 Request body preview: {json.dumps(preview_data)}")
-                
-                # Supabase PKCE token exchange requires JSON format with "code" parameter
-                # Log the actual request body that will be sent
-                request_body_json = json.dumps(token_data)
-                print(f"🔐 Request body JSON (that will be sent): {request_body_json}")
-                print(f"🔐 Request body JSON length: {len(request_body_json)}")
-                
-                # CRITICAL: Include both apikey and Authorization headers (matching Supabase SDK behavior)
-                # This ensures Supabase can properly identify the request and find the flow state
-                request_headers = {
-                    "apikey": supabase_anon_key,
-                    "Authorization": f"Bearer {supabase_anon_key}",  # Required: matches Supabase SDK behavior
-                    "Content-Type": "application/json"
-                }
-                print(f"🔐 Request headers (sanitized): apikey={'***' + supabase_anon_key[-10:] if supabase_anon_key else 'NOT SET'}, Authorization=Bearer ***{supabase_anon_key[-10:] if supabase_anon_key else 'NOT SET'}, Content-Type=application/json")
-                
-                token_response = await client.post(
-                    token_url,
-                    json=token_data,
-                    headers=request_headers,
-                    timeout=30.0
-                )
-                print(f"🔐 Supabase REST API response status: {token_response.status_code}")
-                print(f"🔐 Supabase REST API response text: {token_response.text[:500]}")
-                
-                if token_response.status_code != 200:
-                    error_text = token_response.text
-                    print(f"❌ Supabase REST API error: {error_text}")
-                    raise HTTPException(
-                        status_code=token_response.status_code,
-                        detail=f"Failed to exchange code: {error_text}"
-                    )
-                
-                token_json = token_response.json()
-                print(f"🔐 Supabase REST API response keys: {list(token_json.keys())}")
-                
-                # Convert REST API response to match SDK response format
-                if "access_token" in token_json and "user" in token_json:
-                    # Create a mock response object
-                    class MockResponse:
-                        def __init__(self, data):
-                            self.session = type('Session', (), {
-                                'access_token': data.get('access_token'),
-                                'refresh_token': data.get('refresh_token'),
-                                'expires_in': data.get('expires_in'),
-                                'token_type': data.get('token_type', 'bearer')
-                            })()
-                            self.user = type('User', (), data.get('user', {}))()
-                    
-                    response = MockResponse(token_json)
-                else:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Invalid response from Supabase: missing access_token or user"
-                    )
-        else:
-            # Try non-PKCE flow using SDK (may not work if OAuth URL was generated with PKCE)
-            print(f"🔐 Using Supabase Python SDK for non-PKCE exchange")
-            response = supabase.auth.exchange_code_for_session({
-                "code": code
-            })
-        
-        if not response or not response.session or not response.user:
-            raise HTTPException(
-                status_code=400,
-                detail="Failed to exchange code for session: Invalid response from Supabase"
-            )
-        
-        # Return token information
-        token = Token(
-            access_token=response.session.access_token,
-            refresh_token=response.session.refresh_token,
-            token_type="bearer",
-            user={
-                "id": response.user.id,
-                "email": response.user.email or ""
-            }
-        )
-        
-        print(f"✅ Successfully exchanged code for session, user: {response.user.email}")
-        return token
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        import traceback
-        error_trace = traceback.format_exc()
-        print(f"❌ Failed to exchange OAuth code: {e}")
-        print(f"Error stack:\n{error_trace}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to exchange OAuth code: {str(e)}"
-        )
 
 
 @app.post("/api/auth/set-session", tags=["Authentication"])
@@ -1038,26 +852,23 @@ async def set_session(request: Request):
     print(f"🔐 /api/auth/set-session: Received request")
     
     # If desktop version, forward to Vercel
-    is_desktop = getattr(sys, 'frozen', False)
-    if is_desktop:
-        import httpx
-        vercel_api_url = os.getenv("VERCEL_API_URL", "https://www.desktopai.org")
-        async with httpx.AsyncClient() as http_client:
-            try:
-                body = await request.json()
-                print(f"🔐 /api/auth/set-session: Forwarding to Vercel (desktop version)")
-                response = await http_client.post(
-                    f"{vercel_api_url}/api/auth/set-session",
-                    json=body,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                result = response.json()
-                print(f"✅ /api/auth/set-session: Successfully set session, user: {result.get('user', {}).get('email', 'N/A')}")
-                return result
-            except httpx.HTTPError as e:
-                print(f"❌ /api/auth/set-session: Failed to forward to Vercel: {e}")
-                raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
+    if IS_DESKTOP:
+        http_client = request.app.state.http_client
+        try:
+            body = await request.json()
+            print(f"🔐 /api/auth/set-session: Forwarding to Vercel (desktop version)")
+            response = await http_client.post(
+                f"{VERCEL_API_URL}/api/auth/set-session",
+                json=body,
+                timeout=30.0
+            )
+            response.raise_for_status()
+            result = orjson.loads(response.content)
+            print(f"✅ /api/auth/set-session: Successfully set session, user: {result.get('user', {}).get('email', 'N/A')}")
+            return result
+        except httpx.HTTPError as e:
+            print(f"❌ /api/auth/set-session: Failed to forward to Vercel: {e}")
+            raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
     
     # Non-desktop version: normal processing
     try:
@@ -1193,25 +1004,22 @@ async def logout_endpoint(http_request: Request):
 async def read_users_me(http_request: Request):
     """Get current user information"""
     # If desktop version, forward to Vercel (don't verify token, let Vercel verify)
-    is_desktop = getattr(sys, 'frozen', False)
-    if is_desktop:
-        import httpx
-        vercel_api_url = os.getenv("VERCEL_API_URL", "https://www.desktopai.org")
+    if IS_DESKTOP:
         auth_header = http_request.headers.get("Authorization", "")
         if not auth_header:
             raise HTTPException(status_code=401, detail="Missing authentication token")
         
-        async with httpx.AsyncClient() as http_client:
-            try:
-                response = await http_client.get(
-                    f"{vercel_api_url}/api/me",
-                    headers={"Authorization": auth_header},
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPError as e:
-                raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
+        http_client = http_request.app.state.http_client
+        try:
+            response = await http_client.get(
+                f"{VERCEL_API_URL}/api/me",
+                headers={"Authorization": auth_header},
+                timeout=30.0
+            )
+            response.raise_for_status()
+            return passthrough_response(response)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
     
     # Non-desktop version: normal processing
     # Prioritize getting session token from Cookie (set after OAuth login)
@@ -1277,25 +1085,22 @@ async def read_users_me(http_request: Request):
 async def get_plan(http_request: Request):
     """Get user current Plan information"""
     # If desktop version, forward to Vercel (don't verify token, let Vercel verify)
-    is_desktop = getattr(sys, 'frozen', False)
-    if is_desktop:
-        import httpx
-        vercel_api_url = os.getenv("VERCEL_API_URL", "https://www.desktopai.org")
+    if IS_DESKTOP:
         auth_header = http_request.headers.get("Authorization", "")
         if not auth_header:
             raise HTTPException(status_code=401, detail="Missing authentication token")
         
-        async with httpx.AsyncClient() as http_client:
-            try:
-                response = await http_client.get(
-                    f"{vercel_api_url}/api/plan",
-                    headers={"Authorization": auth_header},
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPError as e:
-                raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
+        http_client = http_request.app.state.http_client
+        try:
+            response = await http_client.get(
+                f"{VERCEL_API_URL}/api/plan",
+                headers={"Authorization": auth_header},
+                timeout=30.0
+            )
+            response.raise_for_status()
+            return passthrough_response(response)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
     
     # Non-desktop version: normal processing (need to verify token)
     auth_header = http_request.headers.get("Authorization", "")
@@ -1365,34 +1170,31 @@ async def create_checkout(
 ):
     """Create Stripe payment session"""
     # If desktop version, forward to Vercel
-    is_desktop = getattr(sys, 'frozen', False)
-    if is_desktop:
-        import httpx
-        vercel_api_url = os.getenv("VERCEL_API_URL", "https://www.desktopai.org")
+    if IS_DESKTOP:
         auth_header = http_request.headers.get("Authorization", "")
         
         if not auth_header:
             raise HTTPException(status_code=401, detail="Missing authentication token")
         
-        async with httpx.AsyncClient() as http_client:
-            try:
-                response = await http_client.post(
-                    f"{vercel_api_url}/api/plan/checkout",
-                    json={
-                        "plan": request.plan,
-                        "success_url": request.success_url,
-                        "cancel_url": request.cancel_url
-                    },
-                    headers={
-                        "Authorization": auth_header,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPError as e:
-                raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
+        http_client = http_request.app.state.http_client
+        try:
+            response = await http_client.post(
+                f"{VERCEL_API_URL}/api/plan/checkout",
+                json={
+                    "plan": request.plan,
+                    "success_url": request.success_url,
+                    "cancel_url": request.cancel_url
+                },
+                headers={
+                    "Authorization": auth_header,
+                    "Content-Type": "application/json"
+                },
+                timeout=30.0
+            )
+            response.raise_for_status()
+            return passthrough_response(response)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
     
     # Non-desktop version: normal processing
     try:
@@ -1506,29 +1308,26 @@ async def create_checkout(
 async def cancel_plan(http_request: Request):
     """Cancel current subscription"""
     # If desktop version, forward to Vercel
-    is_desktop = getattr(sys, 'frozen', False)
-    if is_desktop:
-        import httpx
-        vercel_api_url = os.getenv("VERCEL_API_URL", "https://www.desktopai.org")
+    if IS_DESKTOP:
         auth_header = http_request.headers.get("Authorization", "")
         
         if not auth_header:
             raise HTTPException(status_code=401, detail="Missing authentication token")
         
-        async with httpx.AsyncClient() as http_client:
-            try:
-                response = await http_client.post(
-                    f"{vercel_api_url}/api/plan/cancel",
-                    headers={
-                        "Authorization": auth_header,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPError as e:
-                raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
+        http_client = http_request.app.state.http_client
+        try:
+            response = await http_client.post(
+                f"{VERCEL_API_URL}/api/plan/cancel",
+                headers={
+                    "Authorization": auth_header,
+                    "Content-Type": "application/json"
+                },
+                timeout=30.0
+            )
+            response.raise_for_status()
+            return passthrough_response(response)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
     
     # Non-desktop version: normal processing (need to verify token)
     auth_header = http_request.headers.get("Authorization", "")
@@ -1558,30 +1357,27 @@ async def downgrade_plan(
     }
     """
     # If desktop version, forward to Vercel
-    is_desktop = getattr(sys, 'frozen', False)
-    if is_desktop:
-        import httpx
-        vercel_api_url = os.getenv("VERCEL_API_URL", "https://www.desktopai.org")
+    if IS_DESKTOP:
         auth_header = http_request.headers.get("Authorization", "")
         
         if not auth_header:
             raise HTTPException(status_code=401, detail="Missing authentication token")
         
-        async with httpx.AsyncClient() as http_client:
-            try:
-                response = await http_client.post(
-                    f"{vercel_api_url}/api/plan/downgrade",
-                    headers={
-                        "Authorization": auth_header,
-                        "Content-Type": "application/json"
-                    },
-                    json=request,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPError as e:
-                raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
+        http_client = http_request.app.state.http_client
+        try:
+            response = await http_client.post(
+                f"{VERCEL_API_URL}/api/plan/downgrade",
+                headers={
+                    "Authorization": auth_header,
+                    "Content-Type": "application/json"
+                },
+                json=request,
+                timeout=30.0
+            )
+            response.raise_for_status()
+            return passthrough_response(response)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"Unable to connect to cloud API: {str(e)}")
     
     # Non-desktop version: normal processing (need to verify token)
     auth_header = http_request.headers.get("Authorization", "")
@@ -1642,38 +1438,35 @@ async def chat(
     - Automatically record usage statistics
     """
     # If desktop version, directly forward to Vercel (don't verify token, let Vercel verify)
-    is_desktop = getattr(sys, 'frozen', False)
-    if is_desktop:
-        import httpx
-        vercel_api_url = os.getenv("VERCEL_API_URL", "https://www.desktopai.org")
+    if IS_DESKTOP:
         auth_header = http_request.headers.get("Authorization", "")
         
         if not auth_header:
             raise HTTPException(status_code=401, detail="Missing authentication token, unable to forward request to cloud")
         
-        async with httpx.AsyncClient() as http_client:
-            try:
-                response = await http_client.post(
-                    f"{vercel_api_url}/api/chat",
-                    json={
-                        "user_input": request.user_input,
-                        "image_base64": request.image_base64,
-                        "context": request.context,
-                        "prompt": request.prompt
-                    },
-                    headers={
-                        "Authorization": auth_header,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=60.0
-                )
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPError as e:
-                raise HTTPException(
-                    status_code=502,
-                    detail=f"Unable to connect to cloud API: {str(e)}"
-                )
+        http_client = http_request.app.state.http_client
+        try:
+            response = await http_client.post(
+                f"{VERCEL_API_URL}/api/chat",
+                json={
+                    "user_input": request.user_input,
+                    "image_base64": request.image_base64,
+                    "context": request.context,
+                    "prompt": request.prompt
+                },
+                headers={
+                    "Authorization": auth_header,
+                    "Content-Type": "application/json"
+                },
+                timeout=60.0
+            )
+            response.raise_for_status()
+            return passthrough_response(response)
+        except httpx.HTTPError as e:
+            raise HTTPException(
+                status_code=502,
+                detail=f"Unable to connect to cloud API: {str(e)}"
+            )
     
     # Non-desktop version: normal processing (need to verify token)
     try:
@@ -2012,7 +1805,7 @@ async def text_chat_legacy(
 # Only add SPA routes when UI directory is detected
 if ui_directory:
     @app.get("/{full_path:path}")
-    async def serve_spa(full_path: str):
+    async def serve_spa(full_path: str, request: Request):
         """Provide SPA route support"""
         # Exclude API and documentation paths
         if (full_path.startswith("api/") or 
@@ -2020,10 +1813,7 @@ if ui_directory:
             raise HTTPException(status_code=404, detail="Not found")
         
         # Return index.html
-        index_path = ui_directory / "index.html"
-        if index_path.exists():
-            return FileResponse(str(index_path))
-        raise HTTPException(status_code=404, detail="UI not found")
+        return index_html_response(request)
 
 
 # ========== Start service ==========
@@ -2066,5 +1856,9 @@ if __name__ == "__main__":
         host=host,
         port=port,
         reload=False,  # Temporarily disable reload when running directly, avoid path issues
+        # C event loop/HTTP parser from uvicorn[standard]; uvloop has no Windows build, so "auto" falls back to asyncio there
+        loop="auto",
+        http="httptools",
+        access_log=not is_production,  # Skip per-request access lines in production
         log_level="info"
     )
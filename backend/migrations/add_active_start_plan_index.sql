@@ -0,0 +1,19 @@
+-- ========================================
+-- Migration: Add partial index for active subscriptions still on the start plan
+-- ========================================
+-- fix_plan_inconsistency.py looks for users whose subscription is active but whose
+-- plan is still 'start', paging through them in user_id order.
+-- This partial index only contains those (normally few) rows, so the query no longer
+-- scans the whole user_plans table, and it already returns rows in user_id order.
+
+CREATE INDEX IF NOT EXISTS idx_user_plans_active_start_plan
+ON user_plans(user_id)
+WHERE subscription_status = 'active' AND plan = 'start';
+
+-- Verify the index was created
+SELECT
+    indexname,
+    indexdef
+FROM pg_indexes
+WHERE tablename = 'user_plans'
+  AND indexname = 'idx_user_plans_active_start_plan';